@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+"""Download media from tweets.
+
+Reads tweet URLs from the command line or from files (one URL per line,
+``#`` comments allowed), cleans and dedups them, then downloads the media
+with yt-dlp. Image-only tweets that yt-dlp rejects are retried with
+gallery-dl. Companion to puppeteer/post_and_archive_improved.js, which
+posts the downloaded files.
+"""
+
+import argparse
+import asyncio
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import stat
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    from inotify_simple import INotify, flags as _in_flags
+except ImportError:
+    INotify = None
+
+try:
+    from gallery_dl import config as gdl_config, job as gdl_job
+except ImportError:
+    gdl_job = None
+
+DEFAULT_URLS_FILE = "StuffToDl.txt"
+_SCRIPT_BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+DEFAULT_OUTPUT_DIR = os.path.expanduser("~/twitter_images")
+_DB_PATH = os.path.expanduser("~/.twitter-dl/downloaded.sqlite")
+
+# Compiled once at import: avoids re's internal cache lookup per URL.
+_TWITTER_STATUS_RE = re.compile(r"twitter\.com/([^/]+)/status/(\d+)")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Download media from tweets via yt-dlp (gallery-dl fallback for image tweets)."
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        default=[DEFAULT_URLS_FILE],
+        help="tweet URLs or files containing one URL per line (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default=DEFAULT_OUTPUT_DIR,
+        help="directory to save media into (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cookies",
+        default=None,
+        help="path to a Netscape-format cookies.txt (needed for protected/NSFW tweets)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="number of downloads to run in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--frag-concurrency",
+        type=int,
+        default=4,
+        help="HLS fragments to fetch in parallel per video (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="print each URL as it is cleaned",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="skip URLs that don't look like tweet status links",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and download URLs as they are appended to the watched file",
+    )
+    parser.add_argument(
+        "--watch",
+        default=DEFAULT_URLS_FILE,
+        help="file to watch for appended URLs in --daemon mode (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+def is_probable_file(path: str) -> bool:
+    """Decide whether a target is a local URL-list file rather than a URL."""
+    # Bounded prefix sniff: rejects URLs without scanning the whole string
+    # or paying a stat() for something that is obviously not a path.
+    if path.startswith(("http://", "https://")):
+        return False
+    try:
+        # One stat() instead of the exists()+isfile() pair.
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        return "://" not in path and ("/" in path or "\\" in path)
+
+
+def clean_twitter_url(url: str) -> Tuple[str, Optional[int]]:
+    """Normalize an already-stripped x.com/twitter.com URL.
+
+    Returns the canonical URL and the numeric tweet id, or None for the
+    id when the URL is not a status link, so callers get cleaning and
+    id extraction in one pass.
+    """
+    # Prefix check + slice beats running the host regex on every URL:
+    # startswith looks at a bounded prefix and bails on the first mismatch.
+    if url.startswith(("https://x.com/", "http://x.com/")):
+        url = "https://twitter.com/" + url.split("x.com/", 1)[1]
+    # We only ever need scheme + host + path, so two splits replace
+    # urlparse's full state machine and its 6-field ParseResult per URL.
+    try:
+        scheme, rest = url.split("://", 1)
+    except ValueError:
+        # Schemeless status links (e.g. twitter.com/u/status/1) still get
+        # canonicalized; anything else passes through untouched.
+        match = _TWITTER_STATUS_RE.search(url)
+        if match:
+            return (
+                f"https://twitter.com/{match.group(1)}/status/{match.group(2)}",
+                int(match.group(2)),
+            )
+        return url, None
+    clean_url = f"{scheme}://{rest.split('?', 1)[0].split('#', 1)[0]}"
+    match = _TWITTER_STATUS_RE.search(clean_url)
+    if match:
+        return f"https://twitter.com/{match.group(1)}/status/{match.group(2)}", int(match.group(2))
+    return clean_url, None
+
+
+def read_urls_file(path: str) -> Iterator[str]:
+    """Yield URLs from a list file, skipping blanks and # comments.
+
+    Maps the file instead of buffered reads: the kernel's readahead
+    prefetches pages for us, and MADV_SEQUENTIAL lets it drop pages
+    we've passed, so even a multi-million-line list only ever keeps the
+    readahead window resident.
+    """
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return  # empty file: nothing to map or yield
+        try:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            for raw in iter(mm.readline, b""):
+                s = raw.strip().decode("utf-8", "ignore")
+                if s and not s.startswith("#"):
+                    yield s
+        finally:
+            mm.close()
+
+
+def _iter_raw_urls(targets: List[str]) -> Iterator[str]:
+    for target in targets:
+        if is_probable_file(target):
+            yield from read_urls_file(target)
+        else:
+            yield target
+
+
+def read_targets(targets: List[str], strict: bool = False, verbose: bool = False) -> List[str]:
+    """Expand file targets into URLs, clean them, and drop duplicates.
+
+    With strict=True, URLs with no recognizable tweet id are dropped up
+    front instead of burning a network round-trip failing in yt-dlp.
+    """
+    urls: List[str] = []
+    seen = set()
+    for u in _iter_raw_urls(targets):
+        clean_url, tweet_id = clean_twitter_url(u.strip())
+        if verbose:
+            # Off by default: a line-buffered print per URL dominates this
+            # loop on big lists.
+            print(f"Cleaned URL: {u} -> {clean_url}")
+        if strict and tweet_id is None:
+            continue
+        # Dedup on the numeric tweet id where we have one: it is canonical
+        # (username case or cleaner misses can't split it) and a smaller key.
+        key = tweet_id if tweet_id is not None else clean_url
+        if key in seen:
+            continue
+        seen.add(key)
+        if tweet_id is not None and _already_downloaded(tweet_id):
+            continue
+        urls.append(clean_url)
+    return urls
+
+
+@lru_cache(maxsize=1)
+def _downloaded_db() -> sqlite3.Connection:
+    """Open (creating on first use) the persistent already-downloaded log.
+
+    Re-runs over the same StuffToDl.txt used to hand every URL back to
+    yt-dlp, which runs its full extractor even when the file already
+    exists on disk; a tweet-id lookup here is a local index probe
+    instead. Shared across threads, guarded by sqlite's own locking.
+    """
+    os.makedirs(os.path.dirname(_DB_PATH), exist_ok=True)
+    db = sqlite3.connect(_DB_PATH, check_same_thread=False)
+    db.execute("CREATE TABLE IF NOT EXISTS done(tweet_id INTEGER PRIMARY KEY)")
+    return db
+
+
+def _already_downloaded(tweet_id: int) -> bool:
+    cur = _downloaded_db().execute("SELECT 1 FROM done WHERE tweet_id = ?", (tweet_id,))
+    return cur.fetchone() is not None
+
+
+def _mark_downloaded(tweet_ids: Iterable[int]) -> None:
+    db = _downloaded_db()
+    with db:  # one transaction for the whole batch
+        db.executemany("INSERT OR IGNORE INTO done VALUES (?)", ((t,) for t in tweet_ids))
+
+
+# Below this, an async prefilter isn't worth its event-loop setup cost.
+_PREFILTER_MIN_URLS = 10
+_DEAD_STATUSES = frozenset({404, 410})
+
+
+def prefilter_dead_urls(urls: List[str]) -> List[str]:
+    """Drop tweets that are already gone before yt-dlp sees them.
+
+    A HEAD request costs a few ms against the 1-2 s extractor run yt-dlp
+    spends before failing on a deleted tweet, so for batches with many
+    dead links this pays for itself many times over. Requires aiohttp;
+    without it (or for small batches) the list passes through untouched.
+    """
+    if aiohttp is None or len(urls) < _PREFILTER_MIN_URLS:
+        return urls
+
+    async def _classify(session, sem, url):
+        try:
+            async with sem, session.head(url, allow_redirects=True) as resp:
+                return resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None  # inconclusive: let yt-dlp decide
+
+    async def _run():
+        sem = asyncio.Semaphore(100)
+        timeout = aiohttp.ClientTimeout(total=15)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            return await asyncio.gather(*(_classify(session, sem, u) for u in urls))
+
+    statuses = asyncio.run(_run())
+    alive = [u for u, status in zip(urls, statuses) if status not in _DEAD_STATUSES]
+    if len(alive) < len(urls):
+        print(f"Skipping {len(urls) - len(alive)} dead URL(s) found by prefilter.")
+    return alive
+
+
+@lru_cache(maxsize=1)
+def check_ffmpeg_available() -> bool:
+    # shutil.which stats every $PATH entry; cache so repeat calls are free.
+    return shutil.which("ffmpeg") is not None
+
+
+@lru_cache(maxsize=1)
+def _resolve_yt_dlp_path() -> Tuple[Optional[str], str]:
+    """Locate the yt-dlp binary (script-local bin/ first). Cached: one PATH walk."""
+    env_path = _SCRIPT_BIN_DIR + os.pathsep + os.environ.get("PATH", "")
+    return shutil.which("yt-dlp", path=env_path), env_path
+
+
+@lru_cache(maxsize=1)
+def _configure_gallery_dl(output_dir: str, cookies_path: Optional[str]) -> None:
+    gdl_config.set((), "base-directory", output_dir)
+    if cookies_path:
+        gdl_config.set(("extractor",), "cookies", cookies_path)
+
+
+def _gallery_dl_fallback(url: str, output_dir: str, cookies_path: Optional[str]) -> bool:
+    """Fetch an image-only tweet with gallery-dl after yt-dlp found no video."""
+    if gdl_job is not None:
+        # In-process API: no interpreter spawn, and gallery-dl's session
+        # pool is reused across every fallback in the batch.
+        _configure_gallery_dl(output_dir, cookies_path)
+        try:
+            return gdl_job.DownloadJob(url).run() == 0
+        except Exception as exc:  # gallery-dl raises per-extractor types
+            print(f"gallery-dl failed for {url}: {exc}", file=sys.stderr)
+            return False
+    gd_args = ["gallery-dl", "--dest", output_dir]
+    if cookies_path:
+        gd_args += ["--cookies", cookies_path]
+    gd_args.append(url)
+    try:
+        result = subprocess.run(gd_args, capture_output=True, text=True)
+    except FileNotFoundError:
+        print(f"gallery-dl is not installed; skipping {url}", file=sys.stderr)
+        return False
+    return result.returncode == 0
+
+
+# URLs per yt-dlp binary invocation: big enough to amortize interpreter
+# startup, small enough that the process pool still overlaps chunks.
+_BINARY_CHUNK_SIZE = 10
+
+
+def _download_with_binary(
+    urls: List[str],
+    output_dir: str,
+    cookies_path: Optional[str],
+    concurrency: int = 8,
+    frag_concurrency: int = 4,
+) -> int:
+    """Fallback when the yt_dlp module is unavailable: drive the yt-dlp binary.
+
+    URLs are grouped into chunks (the CLI accepts several per invocation
+    and reuses its session across them) and up to `concurrency` chunk
+    processes run at once, so neither interpreter startup nor network
+    latency is paid serially per URL.
+    """
+    yt_dlp_path, env_path = _resolve_yt_dlp_path()
+    env = os.environ.copy()
+    if yt_dlp_path is None:
+        print("yt-dlp is not installed (neither the module nor the binary)", file=sys.stderr)
+        return 0
+    env["PATH"] = env_path
+    base_args = [yt_dlp_path, "-o", f"{output_dir}/%(id)s_%(title).100B.%(ext)s"]
+    base_args += ["--concurrent-fragments", str(max(1, frag_concurrency))]
+    if cookies_path:
+        base_args += ["--cookies", cookies_path]
+    base_args.append("--ignore-errors")
+
+    success_count = 0
+
+    def _reap(proc: subprocess.Popen, chunk: List[str]) -> None:
+        nonlocal success_count
+        stderr = proc.communicate()[1]
+        error_lines = [line for line in stderr.splitlines() if line.startswith("ERROR:")]
+        if proc.returncode != 0 and not error_lines:
+            # Died without per-URL errors (crash, OOM kill, missing
+            # dependency): nothing in this chunk can be trusted.
+            sys.stderr.write(stderr)
+            return
+        failures = 0
+        for line in error_lines:
+            failures += 1
+            if "No video could be found" in line:
+                # Error lines name the tweet id, not the URL; map it back.
+                id_match = re.search(r"\b(\d{8,})\b", line)
+                failed = next((u for u in chunk if id_match and id_match.group(1) in u), None)
+                if failed and _gallery_dl_fallback(failed, output_dir, cookies_path):
+                    failures -= 1
+            else:
+                print(line, file=sys.stderr)
+        # Clamp per chunk: one URL can emit several ERROR lines (fragment
+        # retries plus the final error) and must not eat into the successes
+        # of other chunks.
+        success_count += max(0, len(chunk) - failures)
+
+    running: List[Tuple[subprocess.Popen, List[str]]] = []
+    for start in range(0, len(urls), _BINARY_CHUNK_SIZE):
+        chunk = list(urls[start : start + _BINARY_CHUNK_SIZE])
+        if len(running) >= max(1, concurrency):
+            _reap(*running.pop(0))
+        proc = subprocess.Popen(
+            base_args + chunk,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        running.append((proc, chunk))
+    for proc, chunk in running:
+        _reap(proc, chunk)
+    return success_count
+
+
+@lru_cache(maxsize=1)
+def _load_cookiejar(cookies_path: str) -> "yt_dlp.cookies.YoutubeDLCookieJar":
+    """Parse cookies.txt once; every YoutubeDL instance shares the jar.
+
+    yt-dlp re-parses a cookiefile per YoutubeDL construction, which the
+    per-worker instances would multiply. Must be yt-dlp's own jar class
+    (a MozillaCookieJar subclass): extractors call get_cookie_header()
+    on it and the networking layer type-checks it. CookieJar locks
+    internally, so sharing across threads is fine.
+    """
+    jar = yt_dlp.cookies.YoutubeDLCookieJar(cookies_path)
+    jar.load(ignore_discard=True, ignore_expires=True)
+    return jar
+
+
+def _drop_cache(filepath: str) -> None:
+    """Tell the kernel we won't re-read a finished download.
+
+    The archive is write-once, so letting it sit in the page cache only
+    evicts pages other processes still want. No-op where posix_fadvise
+    is unavailable (non-Linux) or the file already vanished.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(filepath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _build_ydl_opts(
+    output_dir: str, cookies_path: Optional[str], frag_concurrency: int = 4
+) -> dict:
+    # output_dir is normalized by the callers, so a plain f-string skips
+    # os.path.join's per-argument separator logic on repeated calls.
+    ydl_opts = {
+        "outtmpl": f"{output_dir}/%(id)s_%(title).100B.%(ext)s",
+        "format": "bestvideo*+bestaudio/best",
+        "quiet": True,
+        "no_warnings": True,
+        "socket_timeout": 30,
+        # Twitter video is HLS with many small fragments; fetching them in
+        # parallel and in 10 MiB chunks hides per-request latency.
+        "concurrent_fragment_downloads": max(1, frag_concurrency),
+        "http_chunk_size": 10 * 1024 * 1024,
+        "post_hooks": [_drop_cache],
+    }
+    return ydl_opts
+
+
+def daemon_loop(
+    path: str, output_dir: str, cookies_path: Optional[str], frag_concurrency: int = 4
+) -> int:
+    """Tail `path` and download URLs as they are appended.
+
+    A single YoutubeDL lives for the whole loop, so its connection pool
+    keeps TCP+TLS sessions to the twimg CDNs warm between downloads and
+    there is no per-URL interpreter or handshake cost. Uses inotify when
+    available, otherwise a 1 s stat poll.
+    """
+    if yt_dlp is None:
+        print("--daemon requires the yt_dlp module", file=sys.stderr)
+        return 1
+    output_dir = os.path.abspath(output_dir).rstrip("/")
+    os.makedirs(output_dir, exist_ok=True)
+    watcher = None
+    if INotify is not None:
+        watcher = INotify()
+        watcher.add_watch(path, _in_flags.MODIFY)
+    seen: set = set()
+    with open(path, "r", encoding="utf-8") as f, yt_dlp.YoutubeDL(
+        _build_ydl_opts(output_dir, cookies_path, frag_concurrency)
+    ) as ydl:
+        if cookies_path:
+            ydl.cookiejar = _load_cookiejar(cookies_path)
+        f.seek(0, os.SEEK_END)
+        print(f"Watching {path} for new URLs (Ctrl-C to stop)...")
+        while True:
+            line = f.readline()
+            if not line:
+                if watcher is not None:
+                    watcher.read()  # blocks until the file is modified
+                else:
+                    time.sleep(1.0)
+                continue
+            s = line.strip()
+            if not s or s.startswith("#"):
+                continue
+            clean_url, tweet_id = clean_twitter_url(s)
+            key = tweet_id if tweet_id is not None else clean_url
+            if key in seen:
+                continue
+            seen.add(key)
+            if tweet_id is not None and _already_downloaded(tweet_id):
+                continue
+            try:
+                ydl.download([clean_url])
+            except yt_dlp.utils.DownloadError as exc:
+                if "No video could be found" not in str(exc):
+                    print(f"Failed to download {clean_url}: {exc}", file=sys.stderr)
+                    continue
+                if not _gallery_dl_fallback(clean_url, output_dir, cookies_path):
+                    # Don't log a failed fallback as done, or every future
+                    # run would silently skip the tweet.
+                    continue
+            if tweet_id is not None:
+                _mark_downloaded([tweet_id])
+
+
+def download_items(
+    urls: List[str],
+    output_dir: str,
+    cookies_path: Optional[str] = None,
+    concurrency: int = 8,
+    frag_concurrency: int = 4,
+) -> int:
+    """Download every URL, `concurrency` at a time. Returns the success count."""
+    output_dir = os.path.abspath(output_dir).rstrip("/")
+    os.makedirs(output_dir, exist_ok=True)
+    if yt_dlp is None:
+        return _download_with_binary(urls, output_dir, cookies_path, concurrency, frag_concurrency)
+
+    ydl_opts = _build_ydl_opts(output_dir, cookies_path, frag_concurrency)
+
+    def _download_one(url: str) -> bool:
+        # YoutubeDL is not documented as thread-safe, so each worker builds
+        # its own instance instead of sharing one across the pool.
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                if cookies_path:
+                    ydl.cookiejar = _load_cookiejar(cookies_path)
+                # extract_info instead of download([url]): it reports success
+                # through its return value, which the gallery-dl routing needs.
+                info = ydl.extract_info(url, download=True)
+            return info is not None
+        except yt_dlp.utils.DownloadError as exc:
+            if "No video could be found" in str(exc):
+                return _gallery_dl_fallback(url, output_dir, cookies_path)
+            print(f"Failed to download {url}: {exc}", file=sys.stderr)
+            return False
+
+    success_count = 0
+    done_ids: List[int] = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for url, ok in zip(urls, executor.map(_download_one, urls)):
+            if not ok:
+                continue
+            success_count += 1
+            match = _TWITTER_STATUS_RE.search(url)
+            if match:
+                done_ids.append(int(match.group(2)))
+    _mark_downloaded(done_ids)
+    return success_count
+
+
+def main() -> int:
+    args = parse_args()
+    if not check_ffmpeg_available():
+        print("Warning: ffmpeg not found; yt-dlp may be unable to merge formats.", file=sys.stderr)
+    if args.daemon:
+        try:
+            return daemon_loop(args.watch, args.output_dir, args.cookies, args.frag_concurrency)
+        except KeyboardInterrupt:
+            return 0
+    urls = read_targets(args.targets, strict=args.strict, verbose=args.verbose)
+    urls = prefilter_dead_urls(urls)
+    if not urls:
+        # Everything deduped, already logged as downloaded, or dead: an
+        # up-to-date run is a success, not an error.
+        print("No URLs to download.")
+        return 0
+    count = download_items(
+        urls, args.output_dir, args.cookies, args.concurrency, args.frag_concurrency
+    )
+    print(f"Downloaded {count} of {len(urls)} item(s).")
+    return 0 if count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())